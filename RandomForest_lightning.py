@@ -1,12 +1,11 @@
 # Random Forest Model for lightning prediction
+import os
 import numpy as np
-import geopy
-import geopy.distance
-import scipy.interpolate
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn import metrics
 import pandas as pd
+from radial_interpolation import define_radial_grid, radial_interp
 
 """
 This code is exploratory work from my Master's thesis at PSU, attempting
@@ -17,22 +16,39 @@ Forest Classifier.
 -Dmitri Kalashnikov
 """
 
+# incremental mode: when new days of reanalysis are added to the *_ja.npy files,
+# only the new days are interpolated, and written as a new chunk file next to the
+# stored fields (*_cells_<dtype>/ directories), so earlier days are never rewritten.
+# Set to False to reprocess the full record from scratch.
+incremental = True
+
+# dtype policy for stored interpolated fields and features: interpolation itself runs
+# in float64 and is cast afterwards, so float32 halves memory and disk use of the stored
+# fields, and features are then computed from the float32 fields. Set to 'float64' for
+# original full precision.
+dtype = 'float32'
+# compare features and RF predictions against a previous 'float64' run of this script
+# (rf_outputs_float64.npz); off by default, run once with dtype = 'float64' first
+report_precision = False
+
 # import meteorological variables
-z500_ja = np.load('z500_ja.npy')
-slp_ja = np.load('slp_ja.npy')
-tqv_ja = np.load('tqv_ja.npy')
-lapse700500_ja = np.load('lapse700500_ja.npy')
-omega500_ja = np.load('omega500_ja.npy')
-qv500_ja = np.load('qv500_ja.npy')
-qv700_ja = np.load('qv700_ja.npy')
-qv2M_ja = np.load('qv2M_ja.npy')
-tqi_ja = np.load('tqi_ja.npy')
+# memory-mapped, so fields are not loaded up front; with (lon, lat, day) layout, reading
+# new days still touches every lon/lat row of the file
+z500_ja = np.load('z500_ja.npy', mmap_mode = 'r')
+slp_ja = np.load('slp_ja.npy', mmap_mode = 'r')
+tqv_ja = np.load('tqv_ja.npy', mmap_mode = 'r')
+lapse700500_ja = np.load('lapse700500_ja.npy', mmap_mode = 'r')
+omega500_ja = np.load('omega500_ja.npy', mmap_mode = 'r')
+qv500_ja = np.load('qv500_ja.npy', mmap_mode = 'r')
+qv700_ja = np.load('qv700_ja.npy', mmap_mode = 'r')
+qv2M_ja = np.load('qv2M_ja.npy', mmap_mode = 'r')
+tqi_ja = np.load('tqi_ja.npy', mmap_mode = 'r')
 
 # import lightning info, subset to study area (interior Pacific Northwest)
 cg_8cells = np.load('cg_8cells.npy')
-cg_8cells_vec = np.reshape(cg_8cells, 14880)
+cg_8cells_vec = np.reshape(cg_8cells, -1) # 14,880 days for original record
 idx_cg = np.where(cg_8cells_vec > 0) # 5,830 lightning days across all 8 cells
-idx_no_cg = np.repeat(0,14880)
+idx_no_cg = np.repeat(0,len(cg_8cells_vec))
 idx_no_cg[idx_cg] = 1
 idx_all = idx_no_cg # index of all days (1 = lightning, 0 = no lightning)
 
@@ -41,42 +57,72 @@ lons_8 = [-116,-120,-118,-116,-122,-120,-118,-116] # center lons
 merra_lats = np.arange(8.5,72.5,0.5) # full extent encompassing all circles
 merra_lons = np.arange(-161.25,-67.5,0.625) # full extent encompassing all circles
 
-# iteration steps --> 1,860 days at each grid cell (x8)
-step1 = np.arange(0,1860,1)
-step2 = np.arange(1860,3720,1)
-step3 = np.arange(3720,5580,1)
-step4 = np.arange(5580,7440,1)
-step5 = np.arange(7440,9300,1)
-step6 = np.arange(9300,11160,1)
-step7 = np.arange(11160,13020,1)
-step8 = np.arange(13020,14880,1)
-steps = [step1,step2,step3,step4,step5,step6,step7,step8]
+def chunk_files(dirname):
+    """
+    Stored chunk files of a record, in day order. Each chunk is named
+    <first day>_<end day>.npy and holds a (days, cells, interpolation points) array.
+    """
+    if not os.path.isdir(dirname):
+        return []
+    return sorted(f for f in os.listdir(dirname) if f.endswith('.npy'))
+
+def chunk_days(fname):
+    """
+    (first day, end day) of a chunk file, from its name.
+    """
+    d0, d1 = os.path.splitext(fname)[0].split('_')
+    return int(d0), int(d1)
+
+def save_chunk(dirname, d0, d1, vals):
+    """
+    Write days d0 to d1 as a new chunk file. Written to a temporary file first and
+    moved into place, so an interrupted run never leaves a truncated chunk. A chunk
+    starting at day 0 is a full record, and replaces any older chunks.
+    """
+    os.makedirs(dirname, exist_ok = True)
+    fname = '%06d_%06d.npy' % (d0, d1)
+    tmp = os.path.join(dirname, fname + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, vals)
+    os.replace(tmp, os.path.join(dirname, fname))
+    if d0 == 0:
+        for old in chunk_files(dirname):
+            if old != fname:
+                os.remove(os.path.join(dirname, old))
+
+# each grid cell is a block of days (1,860 days x8 for original record), in cell order
+def interp_cells(field, end_radius, name):
+    """
+    Radial interpolation of a (lon, lat, day) field around each of the 8 grid cells,
+    using 50 km radial increments and 10 degree azimuth increments. In incremental mode,
+    days already stored in the <name>_<dtype> chunk directory are loaded rather than
+    re-interpolated, and only new days are interpolated and saved as a new chunk.
+    Returns (cell-days, interpolation points), cell blocks in order, as dtype.
+    """
+    dirname = name + '_' + dtype
+    radius_steps, degree_steps = define_radial_grid(50, 50, end_radius, 10)
+    n_points = len(radius_steps) * len(degree_steps) + 1 # plus origin
+    n_days = field.shape[2]
+    files = chunk_files(dirname) if incremental else []
+    n_done = chunk_days(files[-1])[1] if files else 0
+    assert n_done <= n_days, "stored record is longer than input array"
+    cells = np.empty([8,n_days,n_points], dtype = dtype)
+    for fname in files:
+        d0, d1 = chunk_days(fname)
+        cells[:,d0:d1,:] = np.load(os.path.join(dirname, fname)).transpose(1,0,2)
+    if n_done < n_days:
+        for k in range(8):
+            cells[k,n_done:,:] = radial_interp(field[:,:,n_done:], merra_lats, merra_lons,
+                                               lats_8[k], lons_8[k], radius_steps,
+                                               degree_steps, dtype = dtype).T
+        # stored day-major, so new days are a single new chunk
+        save_chunk(dirname, n_done, n_days, cells[:,n_done:,:].transpose(1,0,2))
+    return np.reshape(cells, (-1,n_points))
 
 # radial interpolation of atmpospheric variables
 # repeated for other variables, and different radius distances (not all shown here)
 # this example is for Geopotential Heights (z500) within 1,500 km of location
-z500_1500km = np.empty([14880,1081])
-for k in range(8):
-    lon = lons_8[k]
-    lat = lats_8[k]
-    latvec = []
-    lonvec = []
-    step = steps[k]
-    # calculate interpolation grid
-    for a in np.arange(50,1550,50): # 50 km radial increments (rho's)
-        for b in np.arange(10,370,10): # 10 degree azimuth increments (theta's)
-            start = geopy.Point(lat,lon) # origin
-            circ = geopy.distance.distance(kilometers = a) # great circle distance
-            dest = circ.destination(point = start, bearing = b) # transect along great circle
-            latvec.append(dest[0])
-            lonvec.append(dest[1])
-    latvec = np.hstack([lat, latvec]) # add origin lat
-    lonvec = np.hstack([lon, lonvec]) # add origin lon
-    # interpolate underlying values using radial grid
-    interp_vals = scipy.interpolate.interpn((merra_lons,merra_lats),z500_ja,(lonvec,latvec))
-    del latvec, lonvec
-    interp_vals = np.squeeze(interp_vals)
-    z500_1500km[step,:] = interp_vals.T # interpolated values from r = 1,500 km grid
+z500_1500km = interp_cells(z500_ja, 1500, 'z500_1500km_cells') # r = 1,500 km grid
 
 # some summary statistics
 z500_500km_mean = np.mean(z500_500km, axis = 1)
@@ -123,26 +169,7 @@ z500_1000km_diff3 = z500_1500km[:,742] - z500_1500km[:,760]
 z500_1000km_diff4 = z500_1500km[:,743] - z500_1500km[:,761]
 
 # interpolation for atmospheric moisture content (TQV)
-tqv_500km = np.empty([14880,361])
-for k in range(8):
-    lon = lons_8[k]
-    lat = lats_8[k]
-    latvec = []
-    lonvec = []
-    step = steps[k]
-    for a in np.arange(50,550,50):
-        for b in np.arange(10,370,10):
-            start = geopy.Point(lat,lon)
-            circ = geopy.distance.distance(kilometers = a)
-            dest = circ.destination(point = start, bearing = b)
-            latvec.append(dest[0])
-            lonvec.append(dest[1])
-    latvec = np.hstack([lat, latvec])
-    lonvec = np.hstack([lon, lonvec])
-    interp_vals = scipy.interpolate.interpn((merra_lons,merra_lats),tqv_ja,(lonvec,latvec))
-    del latvec, lonvec
-    interp_vals = np.squeeze(interp_vals)
-    tqv_500km[step,:] = interp_vals.T
+tqv_500km = interp_cells(tqv_ja, 500, 'tqv_500km_cells')
 
 # means within certain radius distances
 tqv_origin = tqv_500km[:,0]
@@ -158,26 +185,7 @@ tqv_450km_mean = np.mean(tqv_500km[:,0:325], axis = 1)
 tqv_500km_mean = np.mean(tqv_500km[:,0:361], axis = 1)
 
 # atmospheric moisture at ~10,000 feet (700 hPa pressure level)
-qv700_500km = np.empty([14880,361])
-for k in range(8):
-    lon = lons_8[k]
-    lat = lats_8[k]
-    latvec = []
-    lonvec = []
-    step = steps[k]
-    for a in np.arange(50,550,50):
-        for b in np.arange(10,370,10):
-            start = geopy.Point(lat,lon)
-            circ = geopy.distance.distance(kilometers = a)
-            dest = circ.destination(point = start, bearing = b)
-            latvec.append(dest[0])
-            lonvec.append(dest[1])
-    latvec = np.hstack([lat, latvec])
-    lonvec = np.hstack([lon, lonvec])
-    interp_vals = scipy.interpolate.interpn((merra_lons,merra_lats),qv700_ja,(lonvec,latvec))
-    del latvec, lonvec
-    interp_vals = np.squeeze(interp_vals)
-    qv700_500km[step,:] = interp_vals.T
+qv700_500km = interp_cells(qv700_ja, 500, 'qv700_500km_cells')
 
 # means within certain radius distances
 qv700_origin = qv700_500km[:,0]
@@ -239,6 +247,20 @@ predictions = rf.predict(test_features)
 # Model Accuracy, how often is the classifier correct?
 print("Accuracy:",metrics.accuracy_score(test_labels, predictions))
 
+# accuracy impact of dtype, against outputs of a float64 run
+np.savez('rf_outputs_' + dtype + '.npz', features = features, predictions = predictions)
+if report_precision and np.dtype(dtype) != np.float64:
+    ref = np.load('rf_outputs_float64.npz')
+    assert ref['features'].shape == features.shape, "float64 run has different record length"
+    # per feature, as features are in mixed units (z500 in m, tqv in mm, qv700 in kg/kg)
+    err = np.abs(features - ref['features']).max(axis = 0)
+    rel_err = err / np.abs(ref['features']).max(axis = 0)
+    print(dtype, "max abs error of each feature vs float64:", err)
+    print(dtype, "max relative error of each feature vs float64:", rel_err)
+    print("Worst relative feature error: feature", np.argmax(rel_err), rel_err.max())
+    print("Accuracy float64:", metrics.accuracy_score(test_labels, ref['predictions']))
+    print("Prediction agreement with float64:", np.mean(predictions == ref['predictions']))
+
 # finding important features
 feature_imp = pd.Series(rf.feature_importances_).sort_values(ascending=False)
 feature_imp
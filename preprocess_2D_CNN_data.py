@@ -1,3 +1,4 @@
+import os
 import numpy as np
 import gzip
 from scipy.interpolate import griddata
@@ -18,6 +19,104 @@ data point.
 -Dmitri Kalashnikov
 """
 
+# incremental mode: when new days are added to the *_deps_2deg_dups.npy.gz files,
+# only the new days are scaled and regridded, and written as a new chunk file next to
+# the stored meshgrids (regrid_*_scaled/ directories), so earlier days are never
+# rewritten. Each chunk is saved together with the 0-1 scaling min/max it was scaled
+# with. Set to False to reprocess the full record.
+incremental = True
+
+# policy for the 0-1 scaling min/max when appending new days:
+# 'frozen' keeps the stored min/max, and new values outside that range are clipped to 0 or 1
+# (number of clipped values is printed for each variable);
+# 'update' widens the min/max to include new values, and stored meshgrids are rescaled to
+# the widened min/max when loaded
+scaling_policy = 'frozen'
+assert scaling_policy in ('frozen', 'update'), "scaling_policy must be 'frozen' or 'update'"
+n_cells = 8 # rows of each variable are 8 blocks of days, one per grid cell
+
+# dtype policy: meshgrids are held in memory as float32 (half of float64), and stored on
+# disk as 'float32' (default), or optionally as lossy 'float16' or 'uint16' (quantized with
+# scale/offset, a quarter of float64). Inputs are all scaled to [0, 1], so uint16 error
+# is < 1e-5.
+dtype = 'float32'
+storage = 'float32'
+report_precision = False # compare sample of new days against float64 regrid (70 extra regrids)
+nan_uint16 = 65535 # reserved for points outside unit circle (NaN in meshgrid)
+
+def encode(vals):
+    """
+    Convert [0, 1] meshgrids to storage dtype. Returns (stored values, scale, offset),
+    where float values = stored values * scale + offset.
+    """
+    if storage == 'uint16':
+        scale, offset = 1 / (nan_uint16 - 1), 0.
+        q = np.round((np.clip(vals, 0, 1) - offset) / scale)
+        q[np.isnan(vals)] = nan_uint16
+        return q.astype('uint16'), scale, offset
+    return vals.astype(storage), 1., 0.
+
+def decode(stored):
+    """
+    Convert stored meshgrids (loaded chunk file) back to dtype.
+    """
+    if stored['vals'].dtype != np.uint16:
+        return stored['vals'].astype(dtype)
+    scale, offset = stored['scale'].astype(dtype), stored['offset'].astype(dtype)
+    vals = stored['vals'].astype(dtype) * scale + offset
+    vals[stored['vals'] == nan_uint16] = np.nan
+    return vals
+
+def chunk_files(dirname):
+    """
+    Stored chunk files of a record, in day order. Each chunk is named
+    <first day>_<end day>.npz and holds (days, cells, 40, 40) meshgrids.
+    """
+    if not os.path.isdir(dirname):
+        return []
+    return sorted(f for f in os.listdir(dirname) if f.endswith('.npz'))
+
+def chunk_days(fname):
+    """
+    (first day, end day) of a chunk file, from its name.
+    """
+    d0, d1 = os.path.splitext(fname)[0].split('_')
+    return int(d0), int(d1)
+
+def save_chunk(dirname, d0, d1, **arrays):
+    """
+    Write days d0 to d1 as a new chunk file. Written to a temporary file first and
+    moved into place, so an interrupted run never leaves a truncated chunk. A chunk
+    starting at day 0 is a full record, and replaces any older chunks.
+    """
+    os.makedirs(dirname, exist_ok = True)
+    fname = '%06d_%06d.npz' % (d0, d1)
+    tmp = os.path.join(dirname, fname + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, os.path.join(dirname, fname))
+    if d0 == 0:
+        for old in chunk_files(dirname):
+            if old != fname:
+                os.remove(os.path.join(dirname, old))
+
+def load_chunks(dirname, files, a_min, a_max, out):
+    """
+    Load stored chunks into out, (cells, days, 40, 40) meshgrids, scaled with (a_min, a_max).
+    """
+    for fname in files:
+        d0, d1 = chunk_days(fname)
+        chunk = np.load(os.path.join(dirname, fname))
+        vals = decode(chunk)
+        c_min, c_max = chunk['min'], chunk['max']
+        if c_min != a_min or c_max != a_max:
+            # scaling and linear griddata are both linear, so chunks scaled with an older
+            # min/max can be rescaled directly instead of regridded again
+            factor = np.asarray((c_max - c_min) / (a_max - a_min), dtype = dtype)
+            shift = np.asarray((c_min - a_min) / (a_max - a_min), dtype = dtype)
+            vals = vals * factor + shift
+        out[:,d0:d1] = vals.transpose(1,0,2,3)
+
 # variables are 14880 x 756
 with gzip.open('z500_deps_2deg_dups.npy.gz', 'rb') as f: # Geopotential heights
     z500_deps_2deg = np.load(f)
@@ -40,29 +139,9 @@ with gzip.open('qv700_deps_2deg_dups.npy.gz', 'rb') as f: # Moisture at approx.
 with gzip.open('qv2M_deps_2deg_dups.npy.gz', 'rb') as f: # Moisture at ground level
     qv2M_deps_2deg = np.load(f)
 
-# scaling values to between 0 and 1, following neural network tutorial
-a = z500_deps_2deg
-z500_scaled = np.interp(a, (a.min(), a.max()), (0, +1))
-a = slp_deps_2deg
-slp_scaled = np.interp(a, (a.min(), a.max()), (0, +1))
-a = tqv_deps_2deg
-tqv_scaled = np.interp(a, (a.min(), a.max()), (0, +1))
-a = lapse700500_deps_2deg
-lapse700500_scaled = np.interp(a, (a.min(), a.max()), (0, +1))
-a = qv500_deps_2deg
-qv500_scaled = np.interp(a, (a.min(), a.max()), (0, +1))
-a = qv700_deps_2deg
-qv700_scaled = np.interp(a, (a.min(), a.max()), (0, +1))
-a = qv2M_deps_2deg
-qv2M_scaled = np.interp(a, (a.min(), a.max()), (0, +1))
-
-# concatenating scaled values into single input field
-all_vars = np.concatenate((z500_scaled, slp_scaled, tqv_scaled, # 104160,756
-                           lapse700500_scaled, qv500_scaled, qv700_scaled,
-                           qv2M_scaled), axis = 0)
-
-# reshaping to 2D in order to convert polar (theta, rho) circle coords back to cartesian (x,y)
-all_vals = np.reshape(all_vars, (104160,21,36)).astype('float32')
+var_names = ['z500','slp','tqv','lapse700500','qv500','qv700','qv2M']
+deps_2deg = [z500_deps_2deg, slp_deps_2deg, tqv_deps_2deg, lapse700500_deps_2deg,
+             qv500_deps_2deg, qv700_deps_2deg, qv2M_deps_2deg]
 
 # defining function to convert polar coords to cartesian
 def pol2cart(theta, rho):
@@ -100,11 +179,61 @@ twilio_num = '+19712564892' # my twilio number
 my_cell = '+15039296502' # my cell number
 
 # interpolating values onto square meshgrid (the 'image') for input to 2D CNN model
-regrid_vals_scaled = np.empty([104160,40,40])
-for k in tqdm(range(104160)): # tqdm wrapper to show progress bar in console
-    values = all_vals[k,:,:]
-    values = np.reshape(values, (756))
-    regrid_vals_scaled[k,:,:] = griddata(points, values, (grid_x, grid_y), method='linear')
+# only days not already stored are regridded; full record is 104160 (7 vars x 14880).
+# stored and new meshgrids are written straight into the single output array, and
+# only one variable's scaled values are held at a time
+regrid_vals_scaled = np.empty([sum(len(a) for a in deps_2deg),40,40], dtype = dtype)
+row = 0
+for var, a in zip(var_names, deps_2deg):
+    regrid = np.reshape(regrid_vals_scaled[row:row+len(a)], (n_cells,-1,40,40)) # view
+    row += len(a)
+    a = np.reshape(a, (n_cells,-1,756))
+    dirname = 'regrid_' + var + '_scaled'
+    files = chunk_files(dirname) if incremental else []
+    if files:
+        n_done = chunk_days(files[-1])[1]
+        assert n_done <= a.shape[1], "stored record is longer than input array"
+        last = np.load(os.path.join(dirname, files[-1])) # latest (widest) min/max
+        a_min, a_max = last['min'], last['max']
+        new = a[:,n_done:]
+        if new.size > 0 and scaling_policy == 'update':
+            a_min, a_max = min(a_min, new.min()), max(a_max, new.max())
+        elif new.size > 0:
+            n_out = np.count_nonzero((new < a_min) | (new > a_max))
+            print(var, n_out, 'new values outside frozen min/max, clipped to 0 or 1')
+        load_chunks(dirname, files, a_min, a_max, regrid)
+    else:
+        n_done = 0
+        a_min, a_max = a.min(), a.max()
+    n_new = a.shape[1] - n_done
+
+    # scaling values to between 0 and 1, following neural network tutorial
+    scaled = np.interp(a[:,n_done:], (a_min, a_max), (0, +1)).astype(dtype)
+    # reshaping to 2D in order to convert polar (theta, rho) circle coords back to cartesian (x,y)
+    all_vals = np.reshape(scaled, (-1,21,36))
+    for k in tqdm(range(all_vals.shape[0])): # tqdm wrapper to show progress bar in console
+        cell, day = divmod(k, n_new)
+        values = all_vals[k,:,:]
+        values = np.reshape(values, (756))
+        regrid[cell,n_done+day,:,:] = griddata(points, values, (grid_x, grid_y), method='linear')
+    del scaled, all_vals
+    if report_precision and n_new > 0:
+        # accuracy impact of dtype and storage, on (up to) 10 new days of first grid cell
+        sample = np.interp(a[0,n_done:n_done+10], (a_min, a_max), (0, +1)) # float64
+        ref = np.array([griddata(points, v, (grid_x, grid_y), method='linear') for v in sample])
+        vals = regrid[0,n_done:n_done+10]
+        q, scale, offset = encode(vals)
+        print(var, dtype, 'max abs error vs float64:', np.nanmax(np.abs(vals - ref)))
+        print(var, storage, 'max abs error vs float64:',
+              np.nanmax(np.abs(q.astype('float64') * scale + offset - ref)))
+    if n_new > 0:
+        # stored day-major, so new days are a single new chunk; min/max saved with
+        # meshgrids, so they always match the scaling of the chunk
+        q, scale, offset = encode(regrid[:,n_done:].transpose(1,0,2,3))
+        save_chunk(dirname, n_done, a.shape[1], vals = q, scale = scale, offset = offset,
+                   min = a_min, max = a_max)
+        del q
+
 message = twilio_cli.messages.create(body = 'Code has finished', # text me when finished
                                     from_ = twilio_num, to = my_cell)
 
@@ -69,7 +69,7 @@ def define_radial_grid(start_radius, radius_step, end_radius, degree_resolution)
 
 
 def radial_interp(a, a_lats, a_lons, center_lat, center_lon, radius_steps, degree_steps,
-                  return_coordinates=False):
+                  return_coordinates=False, dtype=None):
     """
     A function to interpolate continuous, geographic data using a unit circle centered
     on a geographic (lat, lon) point of interest. This methodology was developed by Loikith
@@ -98,6 +98,9 @@ def radial_interp(a, a_lats, a_lons, center_lat, center_lon, radius_steps, degre
     return_coordinates : Boolean to indicate whether lat & lon interpolation coordinates 
                          should be returned, default is "False" for contourf plotting. Set 
                          to "True" if mapping on geographically projected axes. 
+    dtype : Data type of returned interpolated values, default is None (float64, as computed
+            by scipy). Interpolation itself always runs in float64; setting "float32" only
+            casts the result, halving memory and disk use of stored interpolated fields.
 
     Returns
     -------
@@ -135,6 +138,8 @@ def radial_interp(a, a_lats, a_lons, center_lat, center_lon, radius_steps, degre
         interp_lons = np.hstack([center_lon, interp_lons])
 
     interp_vals = si.interpn((a_lons,a_lats),a,(interp_lons,interp_lats))
+    if dtype is not None:
+        interp_vals = interp_vals.astype(dtype)
 
     # For mapping on geographic projection, can use the interpolated (lat,lon) values
     if return_coordinates == True: